@@ -1,14 +1,24 @@
+import asyncio
+import functools
+import hashlib
+import hmac
 import logging
 import os
-import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+from types import MappingProxyType
 
 import boto3
+import orjson
+from botocore.config import Config
+from botocore.exceptions import ClientError
 import torchaudio
-from fastapi import BackgroundTasks, Depends, FastAPI, Header, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Response
+from fastapi.responses import ORJSONResponse
 from fastapi.security import APIKeyHeader
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from inference import load_models, process_voice_conversion
 
@@ -17,7 +27,9 @@ logger = logging.getLogger(__name__)
 
 # Global variables
 models = None
+conversion_executor = None
 API_KEY = os.getenv("API_KEY")
+API_KEY_BYTES = API_KEY.encode() if API_KEY else None
 
 api_key_header = APIKeyHeader(name="Authorization", auto_error=False)
 
@@ -27,12 +39,12 @@ async def verify_api_key(authorization: str = Header(None)):
         logger.warning("No API key provided")
         raise HTTPException(status_code=401, detail="API key is missing")
 
-    if authorization.startswith("Bearer "):
-        token = authorization.replace("Bearer ", "")
-    else:
+    scheme, _, token = authorization.partition(" ")
+    if scheme != "Bearer":
         token = authorization
 
-    if token != API_KEY:
+    # Constant-time comparison so response timing does not leak the key
+    if API_KEY_BYTES is None or not hmac.compare_digest(token.encode(), API_KEY_BYTES):
         logger.warning("Invalid API key provided")
         raise HTTPException(status_code=401, detail="Invalid API key")
 
@@ -40,7 +52,16 @@ async def verify_api_key(authorization: str = Header(None)):
 
 
 def get_s3_client():
-    client_kwargs = {'region_name': os.getenv("AWS_REGION", "us-east-1")}
+    client_kwargs = {
+        'region_name': os.getenv("AWS_REGION", "us-east-1"),
+        # Adaptive mode retries throttling and 5xx errors with exponential
+        # backoff and rate limits the client with a token bucket. Keep-alive
+        # connections are pooled and shared by all requests.
+        'config': Config(retries={'max_attempts': 3, 'mode': 'adaptive'},
+                         max_pool_connections=int(
+                             os.getenv("S3_MAX_POOL_CONNECTIONS", "32")),
+                         tcp_keepalive=True)
+    }
 
     if os.getenv("AWS_ACCESS_KEY_ID") and os.getenv("AWS_SECRET_ACCESS_KEY"):
         client_kwargs.update({
@@ -56,10 +77,63 @@ s3_client = get_s3_client()
 S3_PREFIX = os.getenv("S3_PREFIX", "seedvc-outputs")
 S3_BUCKET = os.getenv("S3_BUCKET", "elevenlabs-clone")
 
+# Conversions share a single model on one GPU, so bound how many run at once
+MAX_CONCURRENT_CONVERSIONS = int(os.getenv("MAX_CONCURRENT_CONVERSIONS", "1"))
+conversion_semaphore = asyncio.Semaphore(MAX_CONCURRENT_CONVERSIONS)
+
+# Output keys are unique per conversion, so the stored object never changes.
+# S3 adds ETag/Last-Modified itself and answers If-None-Match with a 304.
+OUTPUT_UPLOAD_ARGS = {
+    'ContentType': "audio/wav",
+    'CacheControl': "public, max-age=31536000, immutable",
+}
+
+# Encoded outputs up to this size stay in memory, larger ones spill to disk
+OUTPUT_SPOOL_MAX_BYTES = int(os.getenv("OUTPUT_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))
+
+
+# Output keys already confirmed to exist in S3, least recently used first
+MAX_KNOWN_OUTPUT_KEYS = int(os.getenv("MAX_KNOWN_OUTPUT_KEYS", "4096"))
+known_output_keys = OrderedDict()
+
+
+def remember_output_key(key):
+    known_output_keys[key] = None
+    known_output_keys.move_to_end(key)
+    while len(known_output_keys) > MAX_KNOWN_OUTPUT_KEYS:
+        known_output_keys.popitem(last=False)
+
+
+def s3_object_exists(key):
+    try:
+        s3_client.head_object(Bucket=S3_BUCKET, Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+    return True
+
+
+def get_presigned_url(key):
+    return s3_client.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': S3_BUCKET, 'Key': key},
+        ExpiresIn=3600
+    )
+
+
+def conversion_response(key):
+    # Returning the response directly skips FastAPI's generic
+    # jsonable_encoder pass over the return value
+    return ORJSONResponse({
+        "audio_url": get_presigned_url(key),
+        "s3_key": key
+    })
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global models
+    global models, conversion_executor
     logger.info("Loading Seed-VC model...")
     try:
         models = load_models()
@@ -69,78 +143,107 @@ async def lifespan(app: FastAPI):
         logger.error(f"Failed to load model: {e}")
         raise
 
+    # Torch releases the GIL during inference, so worker threads can share
+    # the loaded model without a copy per process
+    conversion_executor = ThreadPoolExecutor(
+        max_workers=MAX_CONCURRENT_CONVERSIONS, thread_name_prefix="seedvc")
+
     yield
 
     logger.info("Shutting down Seed-VC API")
+    conversion_executor.shutdown(wait=True)
 
 app = FastAPI(title="Seed-VC API",
-              lifespan=lifespan)
+              lifespan=lifespan,
+              default_response_class=ORJSONResponse)
 
-TARGET_VOICES = {
+# Read-only, so the responses serialized from it below cannot go stale
+TARGET_VOICES = MappingProxyType({
     "andreas": "examples/reference/andreas1.wav",
     "woman": "examples/reference/s1p1.wav",
     "trump": "examples/reference/trump_0.wav",
-}
+})
+
+# These bodies never change, so serialize them once
+VOICES_BODY = orjson.dumps({"voices": list(TARGET_VOICES.keys())})
+HEALTHY_BODY = orjson.dumps({"status": "healthy", "model": "loaded"})
+UNHEALTHY_BODY = orjson.dumps({"status": "unhealthy", "model": "not loaded"})
+UNSUPPORTED_VOICE_DETAIL = f"Target voice not supported. Choose from: {', '.join(TARGET_VOICES.keys())}"
+
+
+def validate_target_voice(voice):
+    if voice not in TARGET_VOICES:
+        raise HTTPException(
+            status_code=400, detail=UNSUPPORTED_VOICE_DETAIL)
 
 
 class VoiceConversionRequest(BaseModel):
-    source_audio_key: str
+    # Plain S3 key characters only, rejected before any S3 call is made
+    source_audio_key: str = Field(
+        pattern=r"^[A-Za-z0-9_-][A-Za-z0-9_./-]{0,1023}$")
     target_voice: str
 
 
 @app.post("/convert", dependencies=[Depends(verify_api_key)])
-async def generate_speech(request: VoiceConversionRequest, background_tasks: BackgroundTasks):
+async def generate_speech(request: VoiceConversionRequest):
     if not models:
         raise HTTPException(status_code=500, detail="Model not loaded")
 
-    if request.target_voice not in TARGET_VOICES:
-        raise HTTPException(
-            status_code=400, detail=f"Target voice not supported. Choose from: {', '.join(TARGET_VOICES.keys())}")
+    validate_target_voice(request.target_voice)
 
     try:
         target_audio_path = TARGET_VOICES[request.target_voice]
-        logger.info(
-            f"Converting voice: {request.source_audio_key} to {request.target_voice}")
 
-        # Generate a unique filename
-        audio_id = str(uuid.uuid4())
+        # Name the output after its inputs, so converting the same upload to
+        # the same voice again reuses the stored result
+        audio_id = hashlib.blake2b(
+            f"{request.target_voice}|{request.source_audio_key}".encode(),
+            digest_size=16).hexdigest()
         output_filename = f"{audio_id}.wav"
-        local_path = f"/tmp/{output_filename}"
+        s3_key = f"{S3_PREFIX}/{output_filename}"
+
+        if s3_key in known_output_keys or await asyncio.to_thread(s3_object_exists, s3_key):
+            remember_output_key(s3_key)
+            logger.info(f"Reusing converted audio: {s3_key}")
+            return conversion_response(s3_key)
+
+        logger.info(
+            f"Converting voice: {request.source_audio_key} to {request.target_voice}")
 
         logger.info("Downloading source audio")
         source_temp = NamedTemporaryFile(delete=False, suffix=".wav")
         try:
-            s3_client.download_fileobj(
+            await asyncio.to_thread(
+                s3_client.download_fileobj,
                 S3_BUCKET, Key=request.source_audio_key, Fileobj=source_temp)
             source_temp.close()
         except Exception as e:
-            os.unlink(source_temp.name)
+            await asyncio.to_thread(os.unlink, source_temp.name)
             raise HTTPException(
                 status_code=404, detail="Source audio not found")
 
-        vc_wave, sr = process_voice_conversion(
-            models=models, source=source_temp.name, target_name=target_audio_path, output=None)
-
-        os.unlink(source_temp.name)
+        async with conversion_semaphore:
+            vc_wave, sr = await asyncio.get_running_loop().run_in_executor(
+                conversion_executor,
+                functools.partial(process_voice_conversion, models=models, source=source_temp.name,
+                                  target_name=target_audio_path, output=None))
 
-        torchaudio.save(local_path, vc_wave, sr)
-
-        # Upload to S3
-        s3_key = f"{S3_PREFIX}/{output_filename}"
-        s3_client.upload_file(local_path, S3_BUCKET, s3_key)
+        await asyncio.to_thread(os.unlink, source_temp.name)
 
-        presigned_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': S3_BUCKET, 'Key': s3_key},
-            ExpiresIn=3600
-        )
+        # Encode into a spooled buffer and upload from it, so typical WAVs
+        # never touch local disk and long ones do not sit fully in memory
+        with SpooledTemporaryFile(max_size=OUTPUT_SPOOL_MAX_BYTES) as output_buffer:
+            await asyncio.to_thread(
+                torchaudio.save, output_buffer, vc_wave, sr, format="wav")
+            output_buffer.seek(0)
 
-        background_tasks.add_task(os.remove, local_path)
+            # Upload to S3
+            await asyncio.to_thread(
+                s3_client.upload_fileobj, output_buffer, S3_BUCKET, s3_key,
+                ExtraArgs=OUTPUT_UPLOAD_ARGS)
+        remember_output_key(s3_key)
 
-        return {
-            "audio_url": presigned_url,
-            "s3_key": s3_key
-        }
+        return conversion_response(s3_key)
     except Exception as e:
         logger.error(f"Error in voice conversion: {e}")
         raise HTTPException(
@@ -149,11 +252,11 @@ async def generate_speech(request: VoiceConversionRequest, background_tasks: Bac
 
 @app.get("/voices", dependencies=[Depends(verify_api_key)])
 async def list_voices():
-    return {"voices": list(TARGET_VOICES.keys())}
+    return Response(content=VOICES_BODY, media_type="application/json")
 
 
 @app.get("/health", dependencies=[Depends(verify_api_key)])
 async def health_check():
     if models:
-        return {"status": "healthy", "model": "loaded"}
-    return {"status": "unhealthy", "model": "not loaded"}
+        return Response(content=HEALTHY_BODY, media_type="application/json")
+    return Response(content=UNHEALTHY_BODY, media_type="application/json")
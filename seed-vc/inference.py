@@ -11,6 +11,7 @@ import argparse
 import warnings
 import shutil
 import os
+import functools
 
 import numpy as np
 
@@ -272,12 +273,21 @@ def crossfade(chunk1, chunk2, overlap):
     return chunk2
 
 
+@functools.lru_cache(maxsize=16)
+def load_reference_audio(path, sr):
+    # Reference voices are a small fixed set reused on every conversion, so
+    # keep the decoded and resampled audio instead of reloading it each time
+    audio = librosa.load(path, sr=sr)[0]
+    audio.flags.writeable = False
+    return audio
+
+
 @torch.no_grad()
 def process_voice_conversion(models, source, target_name, output, f0_condition=False, auto_f0_adjust=False, pitch_shift=0, diffusion_steps=25, length_adjust=1.0, inference_cfg_rate=0.7):
     model, semantic_fn, f0_fn, vocoder_fn, campplus_model, mel_fn, mel_fn_args = models
     sr = mel_fn_args['sampling_rate']
     source_audio = librosa.load(source, sr=sr)[0]
-    ref_audio = librosa.load(target_name, sr=sr)[0]
+    ref_audio = load_reference_audio(target_name, sr)
 
     sr = 22050 if not f0_condition else 44100
     hop_length = 256 if not f0_condition else 512
@@ -419,7 +429,7 @@ def process_voice_conversion(models, source, target_name, output, f0_condition=F
             generated_wave_chunks.append(output_wave)
             previous_chunk = vc_wave[0, -overlap_wave_len:]
             processed_frames += vc_target.size(2) - overlap_frame_len
-    vc_wave = torch.tensor(np.concatenate(generated_wave_chunks))[
+    vc_wave = torch.from_numpy(np.concatenate(generated_wave_chunks))[
         None, :].float()
     time_vc_end = time.time()
     print(f"RTF: {(time_vc_end - time_vc_start) / vc_wave.size(-1) * sr}")